@@ -0,0 +1,19 @@
+import os
+
+# Loaded automatically by `gunicorn pipe_server:app` (see Procfile).
+# One gthread worker per usable core, capped at MAX_WORKERS; override with WEB_CONCURRENCY.
+# The threads below provide the I/O concurrency that the usual 2n+1 sync-worker rule is
+# meant to supply, so extra processes would only add contention on the SQLite file.
+# sched_getaffinity respects a container's cpuset, but not a CFS CPU quota, so set
+# WEB_CONCURRENCY explicitly on quota-limited dynos.
+# Each worker imports pipe_server after forking and opens its own SQLite writer with a
+# ~20 MB page cache (cache_size=-20000), so budget roughly workers * 20 MB for it.
+MAX_WORKERS = 8
+
+_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+workers = int(os.environ.get("WEB_CONCURRENCY", min(_cores, MAX_WORKERS)))
+
+# threads > 1 selects the gthread worker: sqlite3 and socket I/O release the GIL,
+# so a request blocked on a commit or the source fetch doesn't stall the whole worker.
+# Writes and cache misses still serialise per worker on WRITER_LOCK / _fetch_lock.
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
@@ -1,55 +1,138 @@
+import atexit
+import math
+import os
 import sqlite3
-import requests
+import threading
 import time
-import json
-import random
-from datetime import datetime
+import orjson
+import requests
+from datetime import datetime, timezone
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS  # <-- NEW: Import CORS
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Routes jsonify()/request.json through orjson instead of the stdlib json module."""
+
+    def dumps(self, obj, **kwargs):
+        # Keep Flask's output shape: sorted keys by default, indented in debug mode
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
-CORS(app)  # <-- NEW: Enable CORS for all domains
+app.json = ORJSONProvider(app)
+# Comma-separated allowlist, e.g. CORS_ORIGINS=https://app.example.com; unset allows any origin.
+# max_age lets browsers cache the preflight for a day instead of sending OPTIONS each time.
+CORS_ORIGINS = [o.strip() for o in os.environ.get("CORS_ORIGINS", "*").split(",") if o.strip()]
+CORS(app,
+     origins=CORS_ORIGINS,
+     methods=["GET", "POST"],
+     max_age=86400)
 
 
 # --- CONFIGURATION ---
 DATA_SOURCE_URL = "https://jsonplaceholder.typicode.com/posts"
 DB_NAME = "pipeline_data.db"
+FETCH_TIMEOUT = (2.0, 5.0)  # (connect, read) seconds
+FETCH_CACHE_TTL = 60  # seconds
+
+def _mock_latency_seconds():
+    raw = os.environ.get("MOCK_LATENCY_MS", "0")
+    try:
+        ms = float(raw)
+    except ValueError:
+        ms = None
+    if ms is None or not math.isfinite(ms):
+        raise ValueError(f"MOCK_LATENCY_MS must be a number of milliseconds, got {raw!r}")
+    return max(0.0, ms) / 1000  # negative values disable the delay
+
+# Simulated LLM round-trip latency, paid once per batch; 0 (the default) disables it
+MOCK_LATENCY_S = _mock_latency_seconds()
+SCHEMA_VERSION = 2  # stored in PRAGMA user_version
+
+# --- HTTP CLIENT ---
+# One pooled session per process so repeat fetches reuse the TCP+TLS connection
+http_session = requests.Session()
+http_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=100))
 
 # --- DATABASE SETUP ---
+CREATE_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS processed_posts
+                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       original_id INTEGER,
+                       title TEXT,
+                       body TEXT,
+                       insights TEXT,
+                       sentiment TEXT,
+                       processed_at TIMESTAMP)'''
+# Lookups by source post and time, for read endpoints
+CREATE_INDEX_SQL = '''CREATE INDEX IF NOT EXISTS idx_processed_posts_original_id_processed_at
+                      ON processed_posts (original_id, processed_at)'''
+# Prepared once per WRITER and then served from its statement cache
+INSERT_SQL = "INSERT INTO processed_posts (original_id, title, body, insights, sentiment, processed_at) VALUES (?, ?, ?, ?, ?, ?)"
+
+def _connect():
+    # check_same_thread=False: Flask serves requests from multiple threads
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    # Only takes effect on a brand-new file, and must precede the switch to WAL
+    conn.execute("PRAGMA page_size=8192")
+    if DB_NAME != ":memory:":
+        # WAL: sequential log appends, ~1 fsync per commit, readers don't block the writer
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+    return conn
+
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS processed_posts
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  original_id INTEGER,
-                  title TEXT,
-                  body TEXT,
-                  insights TEXT,
-                  sentiment TEXT,
-                  processed_at TIMESTAMP)''')
-    conn.commit()
-    conn.close()
+    # Skip the DDL on worker restarts once the schema is in place
+    if WRITER.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    c = WRITER.cursor()
+    c.execute(CREATE_TABLE_SQL)
+    c.execute(CREATE_INDEX_SQL)
+    c.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    WRITER.commit()
+
+# Single long-lived writer per process: keeps the page and statement caches warm.
+# sqlite3 connections aren't safe for concurrent use, so writes go through WRITER_LOCK.
+WRITER = _connect()
+WRITER_LOCK = threading.Lock()
+atexit.register(WRITER.close)
 
 # Initialize DB on start
 init_db()
 
 # --- MOCK LLM (Runs locally without API Key) ---
+# Simple keyword-based sentiment
+POSITIVE_WORDS = frozenset(['good', 'great', 'happy', 'sun', 'qui', 'est']) # 'est' is common in latin filler
+CRITICAL_WORDS = frozenset(['error', 'dolor'])
+
 def mock_llm_analysis(text):
     """
     Simulates an LLM analysis to ensure this code runs immediately for you.
     Replace this function with actual OpenAI/Anthropic calls if needed.
     """
-    # Simple keyword-based sentiment
-    positive_words = ['good', 'great', 'happy', 'sun', 'qui', 'est'] # 'est' is common in latin filler
+    lowered = text.lower()
+    words = text.split()
+
     sentiment = "objective"
-    if any(w in text.lower() for w in positive_words):
+    if any(w in lowered for w in POSITIVE_WORDS):
         sentiment = "enthusiastic"
-    elif "error" in text.lower() or "dolor" in text.lower():
+    elif any(w in lowered for w in CRITICAL_WORDS):
         sentiment = "critical"
         
     insights = [
-        f"The text focuses on key themes regarding '{text.split()[0]}'.",
-        f"This post contains {len(text.split())} words, indicating high density.",
+        f"The text focuses on key themes regarding '{words[0]}'.",
+        f"This post contains {len(words)} words, indicating high density.",
         "The tone suggests a formal communication style."
     ]
     
@@ -58,47 +141,99 @@ def mock_llm_analysis(text):
         "sentiment": sentiment
     }
 
+def mock_llm_batch_analysis(texts):
+    """
+    Simulates one batched LLM request covering every text.
+    With a real provider, send all prompts in a single API call here.
+    Returns one result per text, in order; a text that fails yields its exception.
+    """
+    if MOCK_LATENCY_S:
+        time.sleep(MOCK_LATENCY_S)
+
+    results = []
+    for text in texts:
+        try:
+            results.append(mock_llm_analysis(text))
+        except Exception as e:
+            results.append(e)
+    return results
+
 # --- PIPELINE STAGES ---
 
-def stage_fetch_data(limit=3):
-    try:
-        # Disable SSL verification
-        response = requests.get(DATA_SOURCE_URL, timeout=5, verify=False)
-        response.raise_for_status()
-        posts = response.json()
-        return posts[:limit] # Return first 3
-    except Exception as e:
-        print(f"Error fetching data: {e}")
-        return []
+# url -> (expires_at, posts); the lock also coalesces concurrent misses into one fetch
+_fetch_cache = {}
+_fetch_lock = threading.Lock()
+
+def stage_fetch_data(limit=3, refresh=False):
+    with _fetch_lock:
+        cached = _fetch_cache.get(DATA_SOURCE_URL)
+        fresh = cached is not None and cached[0] > time.monotonic()
+        if fresh and not refresh:
+            return cached[1][:limit]
+        try:
+            # Disable SSL verification
+            response = http_session.get(DATA_SOURCE_URL, timeout=FETCH_TIMEOUT, verify=False)
+            response.raise_for_status()
+            posts = orjson.loads(response.content)
+            if not isinstance(posts, list):
+                raise ValueError(f"expected a list of posts, got {type(posts).__name__}")
+            _fetch_cache[DATA_SOURCE_URL] = (time.monotonic() + FETCH_CACHE_TTL, posts)
+            return posts[:limit] # Return first 3
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            # A failed ?refresh=1 still serves the unexpired entry it tried to replace
+            return cached[1][:limit] if fresh else []
+
+def stage_process_items(items, timestamp):
+    """
+    Enriches every item with a single (mocked) LLM call, keeping input order.
+    Returns (processed, errors): the processed dicts, and {position: exception}
+    for items that failed, so one bad item doesn't abort the batch.
+    """
+    prepared = []  # (position, original_id, title, content)
+    errors = {}
 
-def stage_process_item(item):
     # Combine title and body for analysis
-    content = f"{item['title']}\n{item['body']}"
-    
+    for position, item in enumerate(items):
+        try:
+            prepared.append((position, item['id'], item['title'], f"{item['title']}\n{item['body']}"))
+        except Exception as e:
+            errors[position] = e
+
+    if not prepared:
+        return [], errors
+
     # Call AI (Mocked for stability)
-    analysis_result = mock_llm_analysis(content)
-    
-    return {
-        "original_id": item['id'],
-        "original_content": content,
-        "analysis": analysis_result['insights'],
-        "sentiment": analysis_result['sentiment'],
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    analyses = mock_llm_batch_analysis([content for _, _, _, content in prepared])
 
-def stage_store_item(processed_item):
+    processed = []
+    for (position, original_id, title, content), analysis_result in zip(prepared, analyses):
+        if isinstance(analysis_result, Exception):
+            errors[position] = analysis_result
+            continue
+        processed.append({
+            "original_id": original_id,
+            "title": title,
+            "original_content": content,
+            "display": content[:50] + "...", # Truncated for display
+            "analysis": analysis_result['insights'],
+            "sentiment": analysis_result['sentiment'],
+            "timestamp": timestamp
+        })
+    return processed, errors
+
+def stage_store_items(batch):
+    rows = [(processed_item['original_id'],
+             processed_item['title'],
+             processed_item['original_content'],
+             processed_item['analysis'],
+             processed_item['sentiment'],
+             processed_item['timestamp'])
+            for processed_item in batch]
     try:
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute("INSERT INTO processed_posts (original_id, title, body, insights, sentiment, processed_at) VALUES (?, ?, ?, ?, ?, ?)",
-                  (processed_item['original_id'], 
-                   processed_item['original_content'].split('\n')[0], # Title
-                   processed_item['original_content'], 
-                   processed_item['analysis'], 
-                   processed_item['sentiment'], 
-                   processed_item['timestamp']))
-        conn.commit()
-        conn.close()
+        # One transaction for the whole batch; rolled back on error
+        with WRITER_LOCK, WRITER:
+            WRITER.executemany(INSERT_SQL, rows)
         return True
     except Exception as e:
         print(f"Storage Error: {e}")
@@ -116,43 +251,40 @@ def stage_notify(email, count):
 def run_pipeline():
     data = request.json or {}
     notification_email = data.get('email', 'admin@example.com')
-    
-    results = []
-    errors = []
+    refresh = request.args.get('refresh') == '1'  # ?refresh=1 bypasses the fetch cache
     
     # 1. Fetch
-    raw_items = stage_fetch_data(limit=3)
+    raw_items = stage_fetch_data(limit=3, refresh=refresh)
     if not raw_items:
         return jsonify({"error": "Failed to fetch data from source"}), 502
 
-    # 2. Process & Store Loop
-    for item in raw_items:
-        try:
-            # AI Enrichment
-            processed = stage_process_item(item)
-            
-            # Storage
-            stored = stage_store_item(processed)
-            
-            results.append({
-                "original": processed['original_content'][:50] + "...", # Truncated for display
-                "analysis": processed['analysis'],
-                "sentiment": processed['sentiment'],
-                "stored": stored,
-                "timestamp": processed['timestamp']
-            })
-            
-        except Exception as e:
-            errors.append(f"Item {item.get('id', 'unknown')} failed: {str(e)}")
+    # One clock read per request, shared by every row and the response
+    now_iso = datetime.now(timezone.utc).isoformat()
+
+    # 2. Process: enrich the whole batch in one LLM call, keeping input order
+    processed_items, failures = stage_process_items(raw_items, now_iso)
+    errors = [f"Item {raw_items[position].get('id', 'unknown')} failed: {str(e)}"
+              for position, e in sorted(failures.items())]
+
+    # 3. Store
+    stored = stage_store_items(processed_items) if processed_items else False
+
+    results = [{
+        "original": processed['display'],
+        "analysis": processed['analysis'],
+        "sentiment": processed['sentiment'],
+        "stored": stored,
+        "timestamp": processed['timestamp']
+    } for processed in processed_items]
 
-    # 3. Notify
+    # 4. Notify
     notified = stage_notify(notification_email, len(results))
 
-    # 4. Return Response
+    # 5. Return Response
     response_payload = {
         "items": results,
         "notificationSent": notified,
-        "processedAt": datetime.utcnow().isoformat(),
+        "processedAt": now_iso,
         "errors": errors,
         "recordCount": len(results)
     }